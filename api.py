@@ -1,69 +1,343 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import List, Optional
+import os
+import asyncio
+import weakref
+import msgspec
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from typing import Annotated, List, Optional
+from memoryloom.sqlManager import AsyncSQLiteManager
+from memoryloom.retrieval import rerank_api, close_clients
+from memoryloom.index import MemoryIndex, vector_to_blob, blobs_to_vectors
+from memoryloom.AlCaller import AICaller
+from memoryloom.agent import RecordAgent
+from langfuse import Langfuse
+from memoryloom.logger import get_logger
 
-app = FastAPI()
+logger = get_logger()
+
+db = AsyncSQLiteManager("loom.db")
+
+class BufferFullError(Exception):
+    """
+    写入缓冲已满（数据库长时间不可写）
+    """
+
+class WriteBuffer:
+    """
+    写入缓冲 - 攒够一批后用一次事务批量写入，减少fsync次数；
+    缓冲行数超过max_rows时拒绝新的写入
+    """
+    def __init__(self, db: AsyncSQLiteManager, batch_size: int = 64, max_rows: int = 10000):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.rows = {}
+        self.lock = asyncio.Lock()
+        self.stopped = asyncio.Event()
+        self.task = None
+
+    def full(self) -> bool:
+        return sum(len(rows) for rows in self.rows.values()) >= self.max_rows
+
+    async def add(self, table_name: str, row: dict):
+        async with self.lock:
+            if self.full():
+                raise BufferFullError(f"write buffer holds {self.max_rows} rows")
+            self.rows.setdefault(table_name, []).append(row)
+            # 只在刚好攒满一批时写入；写入失败后缓冲区会超过batch_size，
+            # 之后的重试交给后台任务，不再由每个请求在锁内重复尝试
+            if len(self.rows[table_name]) != self.batch_size:
+                return
+            try:
+                await self.write(table_name)
+            except Exception:
+                # 数据仍在缓冲区中，交给后台任务重试，不影响本次请求
+                logger.exception("Failed to write %s batch, will retry", table_name)
+
+    async def write(self, table_name: str):
+        """
+        写入一张表的缓冲数据，调用方需持有self.lock；写入成功后才移出缓冲区
+        """
+        rows = self.rows.get(table_name)
+        if not rows:
+            return
+        await self.db.insert_many(table_name, rows)
+        del self.rows[table_name]
+
+    async def flush(self):
+        async with self.lock:
+            for table_name in list(self.rows):
+                await self.write(table_name)
+
+    def pending(self, table_name: str, user_id: str) -> list[str]:
+        """
+        尚未落盘的记录内容，按写入时间倒序
+        """
+        rows = self.rows.get(table_name, [])
+        return [row["content"] for row in reversed(rows) if row["user_id"] == user_id]
+
+    def start(self, interval: float = 1.0):
+        self.task = asyncio.create_task(self.run(interval))
+
+    async def stop(self):
+        """
+        通知后台任务做最后一次写入后退出，不取消任务，避免写到一半被打断
+        """
+        self.stopped.set()
+        if self.task is not None:
+            await self.task
+
+    async def run(self, interval: float = 1.0):
+        while True:
+            try:
+                await asyncio.wait_for(self.stopped.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush write buffer, will retry")
+            # 先写入再检查退出，即使任务启动前就已调用stop也会做最后一次写入
+            if self.stopped.is_set():
+                break
+
+write_buffer = WriteBuffer(db)
+memory_index = MemoryIndex()
+# 每个用户一把锁，加载/写入某个用户的索引时不阻塞其他用户
+user_locks = weakref.WeakValueDictionary()
+# 向量召回的候选数量为topk的倍数，再交给rerank模型精排
+RECALL_FACTOR = 4
+# 检索时每类记忆最多读取的行数，也是加载索引时的分页大小
+RETRIEVE_LIMIT = 1000
+
+def user_lock(username: str) -> asyncio.Lock:
+    """
+    获取用户索引锁，没有协程持有时自动回收
+    """
+    lock = user_locks.get(username)
+    if lock is None:
+        lock = asyncio.Lock()
+        user_locks[username] = lock
+    return lock
+
+async def ensure_user_index(username: str):
+    """
+    首次访问时从数据库加载该用户的长期记忆到向量索引，直接使用库中保存的向量
+    """
+    async with user_lock(username):
+        if memory_index.has_user(username):
+            return
+        # 按id倒序分页加载，避免一次把全部历史读入内存
+        before_id = None
+        while True:
+            rows = await db.fetch_all("long_memory", {"user_id": username},
+                                      limit=RETRIEVE_LIMIT, before_id=before_id)
+            await load_vectors(username, rows)
+            if len(rows) < RETRIEVE_LIMIT:
+                break
+            before_id = rows[-1][0]
+
+async def load_vectors(username: str, rows: list[tuple]):
+    """
+    把一页long_memory加入索引；没有保存向量的旧数据补算一次并写回数据库
+    """
+    missing = [row for row in rows if row[4] is None]
+    if missing:
+        vectors = await asyncio.to_thread(memory_index.embed, [row[2] for row in missing])
+        for row, vector in zip(missing, vectors):
+            await db.update("long_memory", {"embedding": vector_to_blob(vector)}, {"id": row[0]})
+        await asyncio.to_thread(memory_index.add_vectors, username, [row[0] for row in missing], vectors)
+    stored = [row for row in rows if row[4] is not None]
+    await asyncio.to_thread(memory_index.add_vectors, username, [row[0] for row in stored],
+                            blobs_to_vectors([row[4] for row in stored]) if stored else None)
+
+async def fetch_memories_by_ids(ids: list[int]) -> list[str]:
+    """
+    按rowid读取长期记忆，保持ids的顺序
+    """
+    placeholders = ", ".join(["?"] * len(ids))
+    rows = await db.execute(f"SELECT id, content FROM long_memory WHERE id IN ({placeholders})", tuple(ids))
+    contents = dict(rows)
+    return [contents[i] for i in ids if i in contents]
+
+async def rerank(query: str, docs: list[str], topk: int) -> list[str]:
+    """
+    用rerank模型精排候选记忆；未配置或调用失败时按向量召回的顺序返回
+    """
+    if not docs or not os.environ.get("RERANK_API"):
+        return docs[:topk]
+    try:
+        ranks = await rerank_api(query, docs)
+        return [docs[item["index"]] for item in ranks[:topk]]
+    except Exception:
+        logger.exception("Rerank failed, falling back to vector search order")
+        return docs[:topk]
+
+def build_agents() -> dict:
+    """
+    构造接口用到的agent，整个进程共用一个AICaller、langfuse客户端和编译好的schema。
+    未配置LLM或langfuse时返回空字典，不影响不依赖LLM的接口
+    """
+    if not os.environ.get("LLM_MODEL"):
+        logger.warning("LLM_MODEL is not set, agents are disabled")
+        return {}
+    ai_caller = AICaller(
+        model_name=os.environ.get("LLM_MODEL"),
+        api_token=os.environ.get("LLM_API_KEY", "token-abc123"),
+        api_base=os.environ.get("LLM_API_BASE"),
+        proxy=os.environ.get("LLM_PROXY")
+    )
+    try:
+        langfuse_client = Langfuse()
+        return {
+            "record": RecordAgent(ai_caller, langfuse_client=langfuse_client),
+        }
+    except Exception:
+        logger.exception("Failed to initialize agents, agents are disabled")
+        return {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.connect()
+    # agent构造会请求langfuse，放到线程中避免阻塞事件循环
+    app.state.agents = await asyncio.to_thread(build_agents)
+    write_buffer.start()
+    yield
+    await write_buffer.stop()
+    await close_clients()
+    await db.close()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+def get_record_agent(request: Request) -> Optional[RecordAgent]:
+    return request.app.state.agents.get("record")
 
 # ======== 数据模型定义 ========
-class RecordRequest(BaseModel):
+class RecordRequest(msgspec.Struct):
     context: str  # 上下文内容
     username: str
 
-class LongTermMemoryRequest(BaseModel):
+class LongTermMemoryRequest(msgspec.Struct):
     memory_text: str
     username: str
 
-class QueryRequest(BaseModel):
+class QueryRequest(msgspec.Struct):
     query: str
-    topk: int
+    topk: Annotated[int, msgspec.Meta(ge=1)]
     username: str
 
-class MemoryResponse(BaseModel):
-    records: List[str]
-    longterm: List[str]
-    summary: list[str]
+class MemoryResponse(msgspec.Struct):
+    records: List[str] = []
+    longterm: List[str] = []
+    summary: list[str] = []
 
-class UserCreateRequest(BaseModel):
+class UserCreateRequest(msgspec.Struct):
     username: str
 
+async def decode_body(request: Request, type_):
+    """
+    使用msgspec解码并校验请求体，跳过pydantic校验
+    """
+    try:
+        return msgspec.json.decode(await request.body(), type=type_)
+    except msgspec.ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ======== 接口定义 ========
 @app.post("/record")
-async def record_context(request: RecordRequest):
+async def record_context(request: Request, agent: Optional[RecordAgent] = Depends(get_record_agent)):
     """
     记录接口 - 保存上下文信息
     """
-    # 实现存储上下文逻辑
+    body = await decode_body(request, RecordRequest)
+    # 缓冲已满说明数据库持续不可写，直接拒绝，不再调用LLM
+    if write_buffer.full():
+        raise HTTPException(status_code=503, detail="write buffer is full")
+    content = body.context
+    if agent is not None:
+        # 由agent从用户视角总结上下文，LLM调用是阻塞的，放到线程中执行；
+        # 总结失败时保存原始上下文，保证记录不丢失
+        try:
+            output = await asyncio.to_thread(agent, record=body.context, user_name=body.username)
+            if output is not None:
+                content = output.record
+        except Exception:
+            logger.exception("Record agent failed, storing raw context")
+    try:
+        await write_buffer.add("short_memory", {
+            "user_id": body.username,
+            "content": content
+        })
+    except BufferFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return {"status": "recorded"}
 
 @app.post("/longterm")
-async def store_longterm_memory(request: LongTermMemoryRequest):
+async def store_longterm_memory(request: Request):
     """
     记忆接口 - 存储记忆文本
     """
-    # 实现记忆存储逻辑
+    body = await decode_body(request, LongTermMemoryRequest)
+    # 向量随记忆一起保存，重启后加载索引无需重新计算
+    vectors = await asyncio.to_thread(memory_index.embed, [body.memory_text])
+    # 长期记忆需要rowid写入向量索引，因此直接写库而不经过缓冲；
+    # 写库与加入索引在同一把锁内，避免与首次加载并发时同一条记忆被加入两次
+    async with user_lock(body.username):
+        rowid = await db.insert("long_memory", {
+            "user_id": body.username,
+            "content": body.memory_text,
+            "embedding": vector_to_blob(vectors[0])
+        })
+        # 未加载的用户会在首次检索时从数据库整体加载
+        if memory_index.has_user(body.username):
+            await asyncio.to_thread(memory_index.add_vectors, body.username, [rowid], vectors)
     return {"status": "stored"}
 
 @app.post("/retrieve")
-async def smart_retrieve(request: QueryRequest) -> MemoryResponse:
+async def smart_retrieve(request: Request):
     """
     智能读取接口 - 根据query检索记忆
     """
-    # 实现智能检索逻辑
-    return MemoryResponse(results=[])
+    body = await decode_body(request, QueryRequest)
+    condition = {"user_id": body.username}
+    records, summary, _ = await asyncio.gather(
+        db.fetch_all("short_memory", condition, limit=RETRIEVE_LIMIT),
+        db.fetch_all("day_memory", condition, limit=RETRIEVE_LIMIT),
+        ensure_user_index(body.username),
+    )
+    ids = await asyncio.to_thread(memory_index.search, body.username,
+                                  body.query, body.topk * RECALL_FACTOR)
+    docs = await fetch_memories_by_ids(ids) if ids else []
+    docs = await rerank(body.query, docs, body.topk)
+    response = MemoryResponse(
+        # 合并缓冲区中尚未落盘的记录，不必为读取强制刷盘
+        records=(write_buffer.pending("short_memory", body.username)
+                 + [row[2] for row in records])[:RETRIEVE_LIMIT],
+        longterm=docs,
+        summary=[row[2] for row in summary]
+    )
+    return ORJSONResponse(msgspec.to_builtins(response))
 
 
 @app.post("/users/")
-async def create_user(request: UserCreateRequest):
+async def create_user(request: Request):
     """
     添加用户接口
     """
-    # 实现用户创建逻辑
+    body = await decode_body(request, UserCreateRequest)
+    try:
+        await db.insert("users", {"user_id": body.username})
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     return {"status": "created"}
 
 @app.get("/users/{username}/exists")
-async def check_user_exists(username: str) -> bool:
+async def check_user_exists(username: str):
     """
     检查用户是否存在接口
     """
-    # 实现用户存在检查
-    return False
\ No newline at end of file
+    rows = await db.fetch_all("users", {"user_id": username})
+    return bool(rows)
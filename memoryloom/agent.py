@@ -1,4 +1,9 @@
+import orjson
+import hashlib
+import threading
+from functools import lru_cache
 from langfuse import Langfuse
+from cachetools import TTLCache, LRUCache
 from memoryloom.AlCaller import AICaller
 from pydantic import BaseModel, Field
 from abc import ABC, abstractmethod
@@ -8,14 +13,46 @@ from memoryloom.logger import get_logger
 
 logger = get_logger()
 
+# LLM结果缓存，默认进程内LRU，可替换为任意MutableMapping（如redis封装）
+LLM_CACHE = LRUCache(maxsize=1024)
+LLM_CACHE_STATS = {"hits": 0, "misses": 0}
+# agent会在线程池中并发调用，cachetools本身不是线程安全的
+LLM_CACHE_LOCK = threading.Lock()
+
+# 本进程内已确认存在于langfuse的prompt，避免每次构造agent都请求一次
+_INITIALIZED_PROMPTS: set[str] = set()
+
+# 编译后的prompt缓存，键为(prompt_id, version, 变量)；只缓存变量都较短、会重复出现的编译结果
+_COMPILE_CACHE = LRUCache(maxsize=1024)
+_COMPILE_CACHE_LOCK = threading.Lock()
+# 超过该长度的变量（如聊天记录）基本不会重复，不参与缓存
+_COMPILE_CACHE_MAX_VALUE_LEN = 256
+
+@lru_cache(maxsize=None)
+def schema_json(response: type[BaseModel]) -> str:
+    """每个response类只生成一次json schema字符串"""
+    return orjson.dumps(response.model_json_schema()).decode()
+
+def format_message(item: Message) -> str:
+    return f"{item.name}: {item.content}"
+
 class BaseAgent(ABC):
     def __init__(self, ai_caller: AICaller, 
                  prompt: str = None,
                  prompt_type: Literal["text", "chat"] = None,
-                 prompt_id: str = None,):
+                 prompt_id: str = None,
+                 temperature: float = None,
+                 langfuse_client: Langfuse = None):
         self.llm = ai_caller
-        self.langfuse_client = Langfuse()
+        # 为None时使用AICaller的默认采样温度；显式设为0（确定性输出）时才缓存LLM结果
+        self.temperature = temperature
+        # 可由调用方传入共享的langfuse客户端，避免每个agent各建一个
+        self.langfuse_client = langfuse_client or Langfuse()
+        self._prompt_cache = TTLCache(maxsize=64, ttl=300)
+        self._prompt_cache_lock = threading.Lock()
+        self.llm_cache = LLM_CACHE
         self.response = BaseModel
+        self._schema_json = None
         self.agent_name = self.get_agent_name()
         self.prompt_id = self.agent_name
 
@@ -30,31 +67,80 @@ class BaseAgent(ABC):
     def process_history(self, history: list[Message]|str):
         if isinstance(history, str):
             return history
-        else:
-            history_str = "\n\n".join([f"{item.name}: {item.content}" for item in history])
-            return history_str
+        return "\n\n".join(map(format_message, history))
+
+    def extract_json(self, text: str) -> str:
+        """从LLM输出中取出json文本，兼容```json ...```代码块包裹的情况"""
+        stripped = text.strip()
+        if stripped[:1] in ("{", "["):
+            return stripped
+        # 单次扫描代码块，避免正则回溯
+        pos = 0
+        while True:
+            start = text.find("```", pos)
+            if start == -1:
+                break
+            start += 3
+            if text.startswith("json", start):
+                start += 4
+            end = text.find("```", start)
+            if end == -1:
+                break
+            block = text[start:end].strip()
+            if block[:1] in ("{", "["):
+                return block
+            pos = end + 3
+        return stripped
 
     def validate_response(self, response: str):
         try:
-            obj = self.response.model_validate_json(response)
+            obj = self.response.model_validate_json(self.extract_json(response))
             return obj
         except Exception as e:
-            logger.error(str(e))
+            logger.error("%s", e)
             return None
 
+    def fetch_prompt(self, version: int = None):
+        """从langfuse获取prompt，结果按(prompt_id, version)缓存5分钟"""
+        key = (self.prompt_id, version)
+        # cachetools不是线程安全的，读写都要加锁；网络请求放在锁外
+        with self._prompt_cache_lock:
+            prompt = self._prompt_cache.get(key)
+        if prompt is None:
+            prompt = self.langfuse_client.get_prompt(self.prompt_id, version=version)
+            with self._prompt_cache_lock:
+                self._prompt_cache[key] = prompt
+        return prompt
+
     @abstractmethod
-    def get_prompt(self, input: Message|str, history: list[Message]|str):
-        prompt = self.langfuse_client.get_prompt(self.prompt_id)
-        compiled_prompt = prompt.compile(
+    def get_prompt(self, input: Message|str, history: list[Message]|str, prompt=None):
+        prompt = prompt or self.fetch_prompt()
+        compiled_prompt = self.compile_prompt(
+            prompt,
             history = self.process_history(history),
             user_message = input if type(input) is str else str(input),
-            output_schema = self.response.model_json_schema()
+            output_schema = self._schema_json
         )
         return compiled_prompt
 
+    def compile_prompt(self, prompt, **kwargs) -> str:
+        """编译prompt模板，变量都较短时相同模板与相同变量直接返回缓存结果"""
+        # schema字符串虽长但每个response类固定，其余长变量出现时不缓存
+        if any(isinstance(v, str) and len(v) > _COMPILE_CACHE_MAX_VALUE_LEN and v is not self._schema_json
+               for v in kwargs.values()):
+            return prompt.compile(**kwargs)
+        key = (self.prompt_id, getattr(prompt, "version", None), tuple(sorted(kwargs.items())))
+        with _COMPILE_CACHE_LOCK:
+            compiled_prompt = _COMPILE_CACHE.get(key)
+        if compiled_prompt is None:
+            compiled_prompt = prompt.compile(**kwargs)
+            with _COMPILE_CACHE_LOCK:
+                _COMPILE_CACHE[key] = compiled_prompt
+        return compiled_prompt
+
     def generate(self, log_name:str="base", *args, **kwargs):
-        prompt = self.langfuse_client.get_prompt(self.prompt_id)
-        compiled_prompt = self.get_prompt(*args, **kwargs)
+        prompt = self.fetch_prompt()
+        compiled_prompt = self.get_prompt(*args, prompt=prompt, **kwargs)
         
         generation = self.langfuse_client.generation(
             name=log_name,
@@ -69,13 +155,36 @@ class BaseAgent(ABC):
     def __call__(self, *args, **kwargs):
         return self.generate(log_name=self.agent_name, *args, **kwargs)
     
+    def cache_key(self, prompt) -> str:
+        raw = orjson.dumps({
+            "model": self.llm.model,
+            "prompt": prompt,
+            "schema": self.response.__name__
+        }, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(raw).hexdigest()
+
     def call_llm(self, prompt, max_tries=3):
+        use_cache = self.temperature == 0
+        if use_cache:
+            key = self.cache_key(prompt)
+            with LLM_CACHE_LOCK:
+                output = self.llm_cache.get(key)
+                LLM_CACHE_STATS["hits" if output is not None else "misses"] += 1
+            if output is not None:
+                # 返回副本，避免调用方修改缓存中的对象
+                return output.model_copy(deep=True)
+
+        chat_kwargs = {} if self.temperature is None else {"tempture": self.temperature}
         tries = 0
         output = None
         while tries < max_tries and output is None:
-            response = self.llm.chat(prompt, stream=False)
+            response = self.llm.chat(prompt, stream=False, **chat_kwargs)
             output = self.validate_response(response)
             tries += 1
+
+        if use_cache and output is not None:
+            with LLM_CACHE_LOCK:
+                self.llm_cache[key] = output.model_copy(deep=True)
         return output
 
     @abstractmethod
@@ -93,6 +202,8 @@ class BaseAgent(ABC):
         self.__prompt__ = self.__prompt__ if prompt is None else prompt
 
     def init_prompt(self):
+        if self.prompt_id in _INITIALIZED_PROMPTS:
+            return
         try:
             self.langfuse_client.get_prompt(self.prompt_id)
         except:
@@ -102,9 +213,11 @@ class BaseAgent(ABC):
                 prompt=self.__prompt__,
                 labels=["production"]
             )
+        _INITIALIZED_PROMPTS.add(self.prompt_id)
     
-    def set_response(self, response: BaseModel):
+    def set_response(self, response: type[BaseModel]):
         self.response = response
+        self._schema_json = schema_json(response)
 
 class RecordResponse(BaseModel):
     think:str = Field(..., description="思考过程")
@@ -114,9 +227,11 @@ class RecordAgent(BaseAgent):
     def __init__(self, ai_caller: AICaller, 
                  prompt: str = None,
                  prompt_type: Literal["text", "chat"] = None,
-                 prompt_id: str = None,):
-        super().__init__(ai_caller, prompt, prompt_type, prompt_id)
-        self.response = RecordResponse
+                 prompt_id: str = None,
+                 temperature: float = None,
+                 langfuse_client: Langfuse = None):
+        super().__init__(ai_caller, prompt, prompt_type, prompt_id, temperature, langfuse_client)
+        self.set_response(RecordResponse)
     def get_agent_name(self):
         return "record"
     
@@ -130,12 +245,13 @@ class RecordAgent(BaseAgent):
 {{output_schema}}
 """
 
-    def get_prompt(self, record: Message|str, user_name:str):
-        prompt = self.langfuse_client.get_prompt(self.prompt_id)
-        compiled_prompt = prompt.compile(
+    def get_prompt(self, record: Message|str, user_name:str, prompt=None):
+        prompt = prompt or self.fetch_prompt()
+        compiled_prompt = self.compile_prompt(
+            prompt,
             record = self.process_history(record),
-            user_name = user_name,
-            output_schema = self.response.model_json_schema()
+            user = user_name,
+            output_schema = self._schema_json
         )
         return compiled_prompt
 
@@ -148,9 +264,11 @@ class DayAgent(BaseAgent):
     def __init__(self, ai_caller: AICaller, 
                  prompt: str = None,
                  prompt_type: Literal["text", "chat"] = None,
-                 prompt_id: str = None,):
-        super().__init__(ai_caller, prompt, prompt_type, prompt_id)
-        self.response = DayResponse
+                 prompt_id: str = None,
+                 temperature: float = None,
+                 langfuse_client: Langfuse = None):
+        super().__init__(ai_caller, prompt, prompt_type, prompt_id, temperature, langfuse_client)
+        self.set_response(DayResponse)
     def get_agent_name(self):
         return "day"
     
@@ -165,11 +283,12 @@ class DayAgent(BaseAgent):
 {{output_schema}}
 """
 
-    def get_prompt(self, record: Message|str):
-        prompt = self.langfuse_client.get_prompt(self.prompt_id)
-        compiled_prompt = prompt.compile(
+    def get_prompt(self, record: Message|str, prompt=None):
+        prompt = prompt or self.fetch_prompt()
+        compiled_prompt = self.compile_prompt(
+            prompt,
             record = self.process_history(record),
-            output_schema = self.response.model_json_schema()
+            output_schema = self._schema_json
         )
         return compiled_prompt
 
@@ -0,0 +1,165 @@
+import os
+import threading
+import faiss
+import numpy as np
+from memoryloom.logger import get_logger
+
+logger = get_logger()
+
+def vector_to_blob(vector: np.ndarray) -> bytes:
+    """向量转为float32字节串，用于存入数据库"""
+    return np.asarray(vector, dtype="float32").tobytes()
+
+def blobs_to_vectors(blobs: list[bytes]) -> np.ndarray:
+    """数据库中的字节串还原为float32向量矩阵"""
+    return np.stack([np.frombuffer(blob, dtype="float32") for blob in blobs])
+
+class MemoryIndex:
+    def __init__(self, model_name: str = None,
+                 index_factory: str = "HNSW32",
+                 quantized_factory: str = "OPQ32,IVF256,PQ32",
+                 train_size: int = 256 * 39,
+                 nprobe: int = 8):
+        """
+        按用户划分的向量索引，用于在rerank之前召回候选记忆。
+        记忆数量达到train_size后，用户索引会在后台重建为PQ量化索引以节省内存
+
+        Args:
+            model_name (str, optional): sentence-transformers模型名，默认读取EMBED_MODEL环境变量.
+            index_factory (str, optional): 量化前使用的faiss索引描述串. Defaults to "HNSW32".
+            quantized_factory (str, optional): 量化索引描述串. Defaults to "OPQ32,IVF256,PQ32".
+            train_size (int, optional): 触发量化所需的向量数，IVF每个聚类中心约需39个样本. Defaults to 256*39.
+            nprobe (int, optional): 量化索引检索时访问的聚类数. Defaults to 8.
+        """
+        self.model_name = model_name or os.environ.get("EMBED_MODEL", "BAAI/bge-small-zh-v1.5")
+        self.index_factory = index_factory
+        self.quantized_factory = quantized_factory
+        self.train_size = train_size
+        self.nprobe = nprobe
+        self.model = None
+        self.indexes = {}
+        self.quantized = set()
+        self.training = set()
+        self.lock = threading.Lock()
+        self.model_lock = threading.Lock()
+
+    def load_model(self):
+        """
+        加载embedding模型，多个线程同时首次调用时只加载一次
+        """
+        if self.model is None:
+            with self.model_lock:
+                if self.model is None:
+                    # 延迟导入，未使用向量检索时不加载torch
+                    from sentence_transformers import SentenceTransformer
+                    self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        计算归一化后的向量，内积即余弦相似度
+
+        Args:
+            texts (list[str]): 文本列表
+
+        Returns:
+            np.ndarray: float32向量矩阵
+        """
+        vectors = self.load_model().encode(texts, normalize_embeddings=True)
+        return np.asarray(vectors, dtype="float32")
+
+    def new_index(self, dim: int) -> faiss.Index:
+        index = faiss.index_factory(dim, self.index_factory, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexIDMap2(index)
+
+    def quantize(self, user_id: str):
+        """
+        在后台线程中用已有向量训练量化索引，完成后替换用户索引。
+        只在取快照和替换时持有锁，训练期间原索引照常检索和写入
+
+        Args:
+            user_id (str): 用户id
+        """
+        try:
+            with self.lock:
+                index = self.indexes[user_id]
+                count = index.ntotal
+                ids = faiss.vector_to_array(index.id_map)[:count].copy()
+                vectors = index.index.reconstruct_n(0, count)
+            base = faiss.index_factory(index.d, self.quantized_factory, faiss.METRIC_INNER_PRODUCT)
+            base.train(vectors)
+            faiss.extract_index_ivf(base).nprobe = self.nprobe
+            quantized = faiss.IndexIDMap2(base)
+            quantized.add_with_ids(vectors, ids)
+            with self.lock:
+                # 训练期间新加入的向量一并迁移
+                index = self.indexes[user_id]
+                if index.ntotal > count:
+                    extra_ids = faiss.vector_to_array(index.id_map)[count:].copy()
+                    quantized.add_with_ids(index.index.reconstruct_n(count, index.ntotal - count), extra_ids)
+                self.indexes[user_id] = quantized
+                self.quantized.add(user_id)
+        except Exception:
+            logger.exception("Failed to quantize index for user %s", user_id)
+        finally:
+            with self.lock:
+                self.training.discard(user_id)
+
+    def has_user(self, user_id: str) -> bool:
+        return user_id in self.indexes
+
+    def add(self, user_id: str, ids: list[int], texts: list[str]):
+        """
+        计算向量并将记忆加入用户索引
+
+        Args:
+            user_id (str): 用户id
+            ids (list[int]): 记忆在数据库中的rowid
+            texts (list[str]): 记忆文本
+        """
+        self.add_vectors(user_id, ids, self.embed(texts) if texts else None)
+
+    def add_vectors(self, user_id: str, ids: list[int], vectors: np.ndarray = None):
+        """
+        将已计算好的向量加入用户索引
+
+        Args:
+            user_id (str): 用户id
+            ids (list[int]): 记忆在数据库中的rowid
+            vectors (np.ndarray, optional): 与ids一一对应的float32向量，为None时仅登记用户
+        """
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if vectors is None or len(vectors) == 0:
+                # 没有记忆的用户也登记一下，避免重复从数据库加载
+                self.indexes.setdefault(user_id, None)
+                return
+            if index is None:
+                index = self.new_index(vectors.shape[1])
+                self.indexes[user_id] = index
+            index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+            if (user_id not in self.quantized and user_id not in self.training
+                    and index.ntotal >= self.train_size):
+                # 训练耗时较长，放到后台线程，不阻塞当前请求
+                self.training.add(user_id)
+                threading.Thread(target=self.quantize, args=(user_id,), daemon=True).start()
+
+    def search(self, user_id: str, query: str, topk: int) -> list[int]:
+        """
+        检索与query最相近的记忆
+
+        Args:
+            user_id (str): 用户id
+            query (str): 查询语句
+            topk (int): 返回数量
+
+        Returns:
+            list[int]: 记忆rowid列表，按相似度降序
+        """
+        index = self.indexes.get(user_id)
+        if index is None or index.ntotal == 0:
+            return []
+        vector = self.embed([query])
+        with self.lock:
+            _, ids = index.search(vector, min(topk, index.ntotal))
+        return [int(i) for i in ids[0] if i != -1]
@@ -1,4 +1,7 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 from pathlib import Path
 
@@ -37,9 +40,16 @@ def get_logger(name: str = "loom", log_file: str = "log/main.log") -> logging.Lo
     console_handler.setFormatter(console_formatter)
     console_handler.setLevel(logging.INFO)  # 控制台只显示INFO及以上级别
 
+    # 日志先进入队列，由后台线程写文件和控制台，避免磁盘IO阻塞调用方
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
     # 添加处理器
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
     return logger
 
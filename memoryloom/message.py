@@ -1,10 +1,18 @@
-from pydantic import BaseModel, Field
-from typing import Literal, Optional
+import msgspec
+from typing import Literal, Optional, get_args
 
-class Message(BaseModel):
-    role: Literal["user", "assistant", "system", "function"] = Field(..., description="消息角色")
-    name: str = Field(None, description="sender名称")
-    content: str = Field(..., description="消息内容")
+Role = Literal["user", "assistant", "system", "function"]
+ROLES = frozenset(get_args(Role))
+
+class Message(msgspec.Struct, frozen=True, kw_only=True):
+    role: Role  # 消息角色
+    name: Optional[str] = None  # sender名称
+    content: str  # 消息内容
+
+    def __post_init__(self):
+        # msgspec只在解码时校验类型，直接构造时也要校验role
+        if self.role not in ROLES:
+            raise ValueError(f"Invalid role: {self.role!r}")
 
     def  __str__(self):
         return f"{self.name}({self.role}): {self.content}"
@@ -1,9 +1,39 @@
 import os
-import requests
+import asyncio
+import httpx
 from dotenv import load_dotenv
 load_dotenv()
 
-def rerank_api(query: str, docs: list[str], use_proxy: bool = False) -> list[dict]:
+# 复用连接的httpx客户端，按代理地址各保留一个，避免每次请求重新握手
+_CLIENTS: dict[str | None, httpx.AsyncClient] = {}
+
+def get_client(proxy: str = None) -> httpx.AsyncClient:
+    """
+    获取（必要时创建）共享的httpx异步客户端
+
+    Args:
+        proxy (str, optional): 代理地址. Defaults to None.
+
+    Returns:
+        httpx.AsyncClient: 带连接池的客户端
+    """
+    client = _CLIENTS.get(proxy)
+    if client is None:
+        limits = httpx.Limits(max_connections=64, max_keepalive_connections=64)
+        transport = httpx.AsyncHTTPTransport(retries=3, limits=limits, proxy=proxy)
+        client = httpx.AsyncClient(transport=transport, timeout=30.0)
+        _CLIENTS[proxy] = client
+    return client
+
+async def close_clients():
+    """
+    关闭所有共享客户端
+    """
+    for client in _CLIENTS.values():
+        await client.aclose()
+    _CLIENTS.clear()
+
+async def rerank_api(query: str, docs: list[str], use_proxy: bool = False) -> list[dict]:
     """
     使用rerank模型计算query和docs的相关性
 
@@ -27,14 +57,14 @@ def rerank_api(query: str, docs: list[str], use_proxy: bool = False) -> list[dic
         proxy = os.environ.get("PROXY_URL", None)
         if proxy is None:
             raise Exception("PROXY_URL is not set")
-        response = requests.post(url, json=payload, proxies={"http": proxy})
     else:
-        response = requests.post(url, json=payload)
-
+        proxy = None
+    response = await get_client(proxy).post(url, json=payload)
+    response.raise_for_status()
     return response.json()
 
 if __name__ == '__main__':
     query = "介绍下雷军"
     docs = ["乔布斯是一个老板","雷军是一个企业家"]
-    resp = rerank_api(query, docs, use_proxy=True)
+    resp = asyncio.run(rerank_api(query, docs, use_proxy=True))
     print(resp) 
\ No newline at end of file
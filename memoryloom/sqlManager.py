@@ -1,6 +1,50 @@
 import sqlite3
+import asyncio
+import aiosqlite
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, List, Any
-from datetime import datetime
+from datetime import date, datetime
+from memoryloom.logger import get_logger
+
+logger = get_logger()
+
+def build_select(table_name: str, condition: Dict[str, Any] = None,
+                 limit: int = None, since: datetime = None, before_id: int = None,
+                 time_column: str = "timestamp", order_by: str = None) -> tuple:
+    """构造查询语句
+    :param table_name: 表名称
+    :param condition: 条件字典 {列名: 值}
+    :param limit: 最多返回的行数
+    :param since: 只返回time_column不早于该时间的行
+    :param before_id: 键集分页，只返回id小于该值的行（配合id DESC排序翻页）
+    :param time_column: since对应的时间列，date类的表传 "date"
+    :param order_by: 排序子句，默认与所用索引的顺序一致：
+                     带since时按time_column倒序（走(user_id, 时间)复合索引），否则按id倒序（走user_id索引）
+    :return: (sql, params)
+    """
+    clauses = [f"{k} = ?" for k in condition] if condition else []
+    params = list(condition.values()) if condition else []
+    if since is not None:
+        clauses.append(f"{time_column} >= ?")
+        if isinstance(since, datetime):
+            # 与CURRENT_TIMESTAMP的存储格式保持一致
+            since = since.strftime("%Y-%m-%d %H:%M:%S")
+        elif isinstance(since, date):
+            since = since.isoformat()
+        params.append(since)
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(before_id)
+    where_clause = " AND ".join(clauses) if clauses else "1=1"
+    sql = f"SELECT * FROM {table_name} WHERE {where_clause}"
+    if order_by is None:
+        order_by = f"{time_column} DESC" if since is not None else "id DESC"
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, tuple(params)
 
 class SQLiteManager:
     def __init__(self, db_path: str = ":memory:"):
@@ -10,6 +54,7 @@ class SQLiteManager:
         self.conn = sqlite3.connect(db_path)
         self.cursor = self.conn.cursor()
         print(f"Connected to database: {db_path}")
+        self.set_pragmas()
         self.initialize_tables()
 
     def __enter__(self):
@@ -20,6 +65,13 @@ class SQLiteManager:
         """退出上下文时关闭连接"""
         self.close()
 
+    def set_pragmas(self):
+        """WAL模式下读写互不阻塞，NORMAL同步级别减少fsync次数"""
+        self.execute("PRAGMA journal_mode=WAL")
+        self.execute("PRAGMA synchronous=NORMAL")
+        self.execute("PRAGMA temp_store=MEMORY")
+        self.execute("PRAGMA mmap_size=268435456")
+
     def initialize_tables(self):
         """初始化所有表"""
         self.create_table("users", {
@@ -65,8 +117,39 @@ class SQLiteManager:
             "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
             "user_id": "TEXT NOT NULL",
             "content": "TEXT NOT NULL",
-            "timestamp": "DATETIME DEFAULT CURRENT_TIMESTAMP"
+            "timestamp": "DATETIME DEFAULT CURRENT_TIMESTAMP",
+            "embedding": "BLOB"
         })
+        # 旧库的long_memory没有向量列，补上
+        self.add_column("long_memory", "embedding", "BLOB")
+        self.initialize_indexes()
+
+    def initialize_indexes(self):
+        """为按user_id查询的字段建立索引，带时间的表另建(user_id, 时间)复合索引
+        单列user_id索引的条目末尾即rowid，按id排序翻页时无需额外排序
+        """
+        self.create_index("users", ["user_id"], unique=True)
+        for table_name in ["short_memory", "day_memory", "week_memory",
+                           "month_memory", "year_memory", "long_memory"]:
+            self.create_index(table_name, ["user_id"])
+        self.create_index("short_memory", ["user_id", "timestamp DESC"])
+        self.create_index("day_memory", ["user_id", "date DESC"])
+        self.create_index("week_memory", ["user_id", "date DESC"])
+        self.create_index("month_memory", ["user_id", "date DESC"])
+        self.create_index("year_memory", ["user_id", "date DESC"])
+        self.create_index("long_memory", ["user_id", "timestamp DESC"])
+
+    def create_index(self, table_name: str, columns: List[str], unique: bool = False):
+        """创建索引
+        :param table_name: 表名称
+        :param columns: 索引列列表，可带排序方向，如 "timestamp DESC"
+        :param unique: 是否唯一索引
+        """
+        suffix = "_".join(col.split()[0] for col in columns)
+        index_name = f"idx_{table_name}_{suffix}"
+        unique_sql = "UNIQUE " if unique else ""
+        sql = f"CREATE {unique_sql}INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})"
+        self.execute(sql)
 
     def create_table(self, table_name: str, columns: Dict[str, str]):
         """创建数据表
@@ -78,6 +161,16 @@ class SQLiteManager:
         self.execute(sql)
         print(f"Table '{table_name}' created/verified")
 
+    def add_column(self, table_name: str, column: str, column_type: str):
+        """为已存在的表补充字段，字段已存在时跳过
+        :param table_name: 表名称
+        :param column: 列名
+        :param column_type: 数据类型
+        """
+        columns = [row[1] for row in self.cursor.execute(f"PRAGMA table_info({table_name})").fetchall()]
+        if column not in columns:
+            self.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {column_type}")
+
     def execute(self, sql: str, params: tuple = (), commit: bool = True) -> Optional[List[tuple]]:
         """执行SQL语句
         :param sql: SQL语句
@@ -107,6 +200,26 @@ class SQLiteManager:
         self.execute(sql, tuple(data.values()))
         return self.cursor.lastrowid
 
+    def insert_many(self, table_name: str, data: List[Dict[str, Any]]) -> int:
+        """批量插入数据，在同一个事务中提交
+        :param table_name: 表名称
+        :param data: 数据字典列表，所有字典的列需一致
+        :return: 插入的行数
+        """
+        if not data:
+            return 0
+        columns = list(data[0].keys())
+        placeholders = ", ".join(["?"] * len(columns))
+        sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        rows = [tuple(item[k] for k in columns) for item in data]
+        try:
+            self.cursor.executemany(sql, rows)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise RuntimeError(f"Database error: {e}")
+        return len(rows)
+
     def update(self, table_name: str, data: Dict[str, Any], condition: Dict[str, Any]) -> int:
         """更新数据
         :param table_name: 表名称
@@ -132,15 +245,15 @@ class SQLiteManager:
         self.execute(sql, tuple(condition.values()))
         return self.cursor.rowcount
 
-    def fetch_all(self, table_name: str, condition: Dict[str, Any] = None) -> List[tuple]:
-        """查询数据
+    def fetch_all(self, table_name: str, condition: Dict[str, Any] = None,
+                  limit: int = None, since: datetime = None, before_id: int = None,
+                  time_column: str = "timestamp", order_by: str = None) -> List[tuple]:
+        """查询数据，参数含义见build_select
         :param table_name: 表名称
         :param condition: 条件字典 {列名: 值}
         :return: 结果列表
         """
-        where_clause = " AND ".join([f"{k} = ?" for k in condition]) if condition else "1=1"
-        sql = f"SELECT * FROM {table_name} WHERE {where_clause}"
-        params = tuple(condition.values()) if condition else ()
+        sql, params = build_select(table_name, condition, limit, since, before_id, time_column, order_by)
         return self.execute(sql, params)
 
     def close(self):
@@ -148,6 +261,170 @@ class SQLiteManager:
         self.conn.close()
         print("Database connection closed")
 
+class AsyncSQLiteManager:
+    def __init__(self, db_path: str = "loom.db", pool_size: int = 4):
+        """异步数据库管理，维护一个aiosqlite连接池
+        :param db_path: 数据库文件路径，连接池中的连接共享同一个文件，不适用于内存数据库
+        :param pool_size: 连接数
+        """
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.pool = asyncio.Queue()
+        self.connections = []
+
+    async def __aenter__(self):
+        """支持异步上下文管理器"""
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """退出上下文时关闭连接池"""
+        await self.close()
+
+    async def connect(self):
+        """建表建索引后打开连接池"""
+        # 表结构与索引沿用同步管理器的定义，只在启动时执行一次
+        await asyncio.to_thread(lambda: SQLiteManager(self.db_path).close())
+        for _ in range(self.pool_size):
+            conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+            await self.set_pragmas(conn)
+            self.connections.append(conn)
+            self.pool.put_nowait(conn)
+        logger.info("Connected to database: %s (pool size %d)", self.db_path, self.pool_size)
+
+    async def set_pragmas(self, conn: aiosqlite.Connection):
+        """WAL模式下读写互不阻塞，写冲突时等待而不是直接报错"""
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        await conn.execute("PRAGMA mmap_size=268435456")
+        await conn.execute("PRAGMA busy_timeout=5000")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """从连接池借出一个连接，归还前回滚未结束的事务（如被取消或异常中断）"""
+        conn = await self.pool.get()
+        try:
+            yield conn
+        finally:
+            # 连接池已关闭时连接也已关闭，无需归还
+            if conn in self.connections:
+                try:
+                    if conn.in_transaction:
+                        await conn.execute("ROLLBACK")
+                finally:
+                    self.pool.put_nowait(conn)
+
+    async def execute(self, sql: str, params: tuple = ()) -> Optional[List[tuple]]:
+        """执行SQL语句（自动提交）
+        :param sql: SQL语句
+        :param params: 参数元组
+        :return: 查询结果集（如果有）
+        """
+        async with self.acquire() as conn:
+            try:
+                cursor = await conn.execute(sql, params)
+                if sql.strip().upper().startswith("SELECT"):
+                    return await cursor.fetchall()
+            except sqlite3.Error as e:
+                raise RuntimeError(f"Database error: {e}")
+
+    async def insert(self, table_name: str, data: Dict[str, Any]) -> int:
+        """插入数据
+        :param table_name: 表名称
+        :param data: 数据字典 {列名: 值}
+        :return: 插入行的rowid
+        """
+        columns = ", ".join(data.keys())
+        placeholders = ", ".join(["?"] * len(data))
+        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+        async with self.acquire() as conn:
+            try:
+                cursor = await conn.execute(sql, tuple(data.values()))
+                return cursor.lastrowid
+            except sqlite3.Error as e:
+                raise RuntimeError(f"Database error: {e}")
+
+    async def insert_many(self, table_name: str, data: List[Dict[str, Any]]) -> int:
+        """批量插入数据，在同一个事务中提交
+        :param table_name: 表名称
+        :param data: 数据字典列表，所有字典的列需一致
+        :return: 插入的行数
+        """
+        if not data:
+            return 0
+        columns = list(data[0].keys())
+        placeholders = ", ".join(["?"] * len(columns))
+        sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        rows = [tuple(item[k] for k in columns) for item in data]
+        async with self.acquire() as conn:
+            try:
+                await conn.execute("BEGIN")
+                await conn.executemany(sql, rows)
+                await conn.execute("COMMIT")
+            except BaseException as e:
+                # 包括任务取消在内的任何异常都先回滚，连接不能带着未提交的事务回到池中
+                if conn.in_transaction:
+                    await conn.execute("ROLLBACK")
+                if isinstance(e, sqlite3.Error):
+                    raise RuntimeError(f"Database error: {e}")
+                raise
+        return len(rows)
+
+    async def update(self, table_name: str, data: Dict[str, Any], condition: Dict[str, Any]) -> int:
+        """更新数据
+        :param table_name: 表名称
+        :param data: 更新数据字典 {列名: 新值}
+        :param condition: 条件字典 {列名: 值}
+        :return: 受影响的行数
+        """
+        set_clause = ", ".join([f"{k} = ?" for k in data])
+        where_clause = " AND ".join([f"{k} = ?" for k in condition]) if condition else "1=1"
+        sql = f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}"
+        params = tuple(data.values()) + (tuple(condition.values()) if condition else ())
+        async with self.acquire() as conn:
+            try:
+                cursor = await conn.execute(sql, params)
+                return cursor.rowcount
+            except sqlite3.Error as e:
+                raise RuntimeError(f"Database error: {e}")
+
+    async def delete(self, table_name: str, condition: Dict[str, Any]) -> int:
+        """删除数据
+        :param table_name: 表名称
+        :param condition: 条件字典 {列名: 值}
+        :return: 受影响的行数
+        """
+        where_clause = " AND ".join([f"{k} = ?" for k in condition]) if condition else "1=1"
+        sql = f"DELETE FROM {table_name} WHERE {where_clause}"
+        params = tuple(condition.values()) if condition else ()
+        async with self.acquire() as conn:
+            try:
+                cursor = await conn.execute(sql, params)
+                return cursor.rowcount
+            except sqlite3.Error as e:
+                raise RuntimeError(f"Database error: {e}")
+
+    async def fetch_all(self, table_name: str, condition: Dict[str, Any] = None,
+                        limit: int = None, since: datetime = None, before_id: int = None,
+                        time_column: str = "timestamp", order_by: str = None) -> List[tuple]:
+        """查询数据，参数含义见build_select
+        :param table_name: 表名称
+        :param condition: 条件字典 {列名: 值}
+        :return: 结果列表
+        """
+        sql, params = build_select(table_name, condition, limit, since, before_id, time_column, order_by)
+        return await self.execute(sql, params)
+
+    async def close(self):
+        """关闭连接池创建的所有连接，包括尚未归还的连接"""
+        for conn in self.connections:
+            await conn.close()
+        self.connections.clear()
+        while not self.pool.empty():
+            self.pool.get_nowait()
+        logger.info("Database connection pool closed")
+
 # 使用示例
 if __name__ == "__main__":
     # 初始化数据库（内存数据库）
@@ -0,0 +1,27 @@
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from memoryloom.logger import get_logger
+
+# 日志默认写到当前目录下的log/，测试时改写到临时目录
+get_logger(log_file=str(Path(tempfile.mkdtemp()) / "main.log"))
+
+
+class FakeModel:
+    """按文本内容生成固定向量的embedding模型，代替sentence-transformers"""
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+
+    def encode(self, texts, normalize_embeddings=True):
+        import zlib
+        import numpy as np
+        vectors = np.stack([
+            np.random.default_rng(zlib.crc32(text.encode())).standard_normal(self.dim)
+            for text in texts
+        ]).astype("float32")
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
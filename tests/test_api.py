@@ -0,0 +1,165 @@
+import os
+import asyncio
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("aiosqlite")
+faiss = pytest.importorskip("faiss")
+# 使用litellm自带的模型价格表，导入时不访问网络
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+api = pytest.importorskip("api")
+
+from fastapi.testclient import TestClient
+from memoryloom.index import MemoryIndex
+from memoryloom.sqlManager import AsyncSQLiteManager
+
+
+class FlakyDB:
+    """前fail_times次批量写入失败的数据库"""
+    def __init__(self, fail_times: int = 0):
+        self.fail_times = fail_times
+        self.calls = 0
+        self.rows = {}
+
+    async def insert_many(self, table_name, data):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise RuntimeError("Database error: database is locked")
+        self.rows.setdefault(table_name, []).extend(data)
+        return len(data)
+
+
+def row(user_id, content):
+    return {"user_id": user_id, "content": content}
+
+
+def test_write_buffer_retains_rows_on_failure():
+    async def main():
+        db = FlakyDB(fail_times=1)
+        buffer = api.WriteBuffer(db, batch_size=2)
+        await buffer.add("short_memory", row("a", "1"))
+        await buffer.add("short_memory", row("a", "2"))
+        # 写入失败，数据保留在缓冲区
+        assert db.calls == 1
+        assert buffer.pending("short_memory", "a") == ["2", "1"]
+        # 超过批量大小后不再由请求重试，交给后台任务
+        await buffer.add("short_memory", row("a", "3"))
+        assert db.calls == 1
+        await buffer.flush()
+        assert db.calls == 2
+        assert [r["content"] for r in db.rows["short_memory"]] == ["1", "2", "3"]
+        assert buffer.pending("short_memory", "a") == []
+    asyncio.run(main())
+
+
+def test_write_buffer_rejects_when_full():
+    async def main():
+        buffer = api.WriteBuffer(FlakyDB(fail_times=100), batch_size=2, max_rows=3)
+        for i in range(3):
+            await buffer.add("short_memory", row("a", str(i)))
+        with pytest.raises(api.BufferFullError):
+            await buffer.add("short_memory", row("a", "3"))
+        assert len(buffer.pending("short_memory", "a")) == 3
+    asyncio.run(main())
+
+
+def test_write_buffer_stop_flushes():
+    async def main():
+        db = FlakyDB()
+        buffer = api.WriteBuffer(db, batch_size=64)
+        buffer.start(interval=60)
+        await buffer.add("short_memory", row("a", "1"))
+        await buffer.stop()
+        assert db.rows["short_memory"] == [row("a", "1")]
+    asyncio.run(main())
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.delenv("LLM_MODEL", raising=False)
+    monkeypatch.delenv("RERANK_API", raising=False)
+    monkeypatch.setattr(api, "db", AsyncSQLiteManager(str(tmp_path / "loom.db")))
+    monkeypatch.setattr(api, "memory_index", MemoryIndex())
+    # 缓冲区写入一直失败，记录只存在于内存中
+    monkeypatch.setattr(api, "write_buffer", api.WriteBuffer(FlakyDB(fail_times=100), batch_size=1))
+    with TestClient(api.app) as client:
+        yield client
+
+
+def test_retrieve_merges_pending_records(client):
+    asyncio.run(api.db.insert("short_memory", row("a", "stored")))
+    for context in ["first", "second"]:
+        assert client.post("/record", json={"context": context, "username": "a"}).status_code == 200
+    client.post("/record", json={"context": "other", "username": "b"})
+    response = client.post("/retrieve", json={"query": "q", "topk": 3, "username": "a"})
+    assert response.status_code == 200
+    assert response.json()["records"] == ["second", "first", "stored"]
+
+
+def test_record_returns_503_when_buffer_full(client):
+    api.write_buffer.max_rows = 1
+    assert client.post("/record", json={"context": "1", "username": "a"}).status_code == 200
+    assert client.post("/record", json={"context": "2", "username": "a"}).status_code == 503
+
+
+@pytest.fixture
+def loaded_db(tmp_path, monkeypatch):
+    from conftest import FakeModel
+    monkeypatch.delenv("RERANK_API", raising=False)
+    index = MemoryIndex()
+    index.model = FakeModel()
+    monkeypatch.setattr(api, "memory_index", index)
+    monkeypatch.setattr(api, "db", AsyncSQLiteManager(str(tmp_path / "loom.db")))
+    return api.db
+
+
+def test_longterm_during_first_load_is_indexed_once(loaded_db, monkeypatch):
+    import httpx
+
+    async def main():
+        async with loaded_db as db:
+            # 旧数据没有保存向量，首次加载时补算
+            await db.insert("long_memory", {"user_id": "a", "content": "old"})
+            await db.insert("long_memory", {"user_id": "a", "content": "stored",
+                                            "embedding": api.vector_to_blob(api.memory_index.embed(["stored"])[0])})
+            fetch_all = db.fetch_all
+
+            async def slow_fetch_all(*args, **kwargs):
+                rows = await fetch_all(*args, **kwargs)
+                # 拉长首次加载的时间窗口，让/longterm的写入落在加载过程中
+                await asyncio.sleep(0.05)
+                return rows
+
+            monkeypatch.setattr(db, "fetch_all", slow_fetch_all)
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                async def store():
+                    await asyncio.sleep(0.01)
+                    return await client.post("/longterm", json={"memory_text": "new", "username": "a"})
+
+                _, response = await asyncio.gather(api.ensure_user_index("a"), store())
+            assert response.status_code == 200
+            rows = await db.execute("SELECT id, embedding FROM long_memory WHERE user_id = 'a'")
+        index = api.memory_index.indexes["a"]
+        assert index.ntotal == len(rows) == 3
+        assert sorted(faiss.vector_to_array(index.id_map)) == sorted(r[0] for r in rows)
+        assert all(r[1] is not None for r in rows)
+    asyncio.run(main())
+
+
+def test_retrieve_falls_back_to_vector_order(loaded_db, monkeypatch):
+    async def failing_rerank(query, docs):
+        raise RuntimeError("rerank unavailable")
+
+    async def main():
+        async with loaded_db as db:
+            for text in ["apple", "banana", "cherry"]:
+                await db.insert("long_memory", {"user_id": "a", "content": text})
+            await api.ensure_user_index("a")
+            expected = await api.fetch_memories_by_ids(api.memory_index.search("a", "banana", 2))
+            assert expected[0] == "banana"
+            assert await api.rerank("banana", expected, 2) == expected
+            monkeypatch.setenv("RERANK_API", "http://rerank.invalid")
+            monkeypatch.setattr(api, "rerank_api", failing_rerank)
+            assert await api.rerank("banana", expected, 1) == expected[:1]
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+import threading
+import time
+import pytest
+
+faiss = pytest.importorskip("faiss")
+np = pytest.importorskip("numpy")
+
+from memoryloom import index as index_module
+from memoryloom.index import MemoryIndex, vector_to_blob, blobs_to_vectors
+
+DIM = 64
+
+
+def random_vectors(count, seed):
+    vectors = np.random.default_rng(seed).standard_normal((count, DIM)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_blob_roundtrip():
+    vectors = random_vectors(3, 0)
+    assert np.array_equal(blobs_to_vectors([vector_to_blob(v) for v in vectors]), vectors)
+
+
+def test_quantize_keeps_vectors_added_during_training(monkeypatch):
+    memory_index = MemoryIndex(quantized_factory="OPQ8,IVF16,PQ8x4", train_size=16 * 39, nprobe=16)
+    training = threading.Event()
+    resume = threading.Event()
+    extract_index_ivf = faiss.extract_index_ivf
+
+    def paused_extract_index_ivf(index):
+        # 训练已完成、尚未替换索引时暂停，模拟训练期间的并发写入
+        training.set()
+        assert resume.wait(10)
+        return extract_index_ivf(index)
+
+    monkeypatch.setattr(index_module.faiss, "extract_index_ivf", paused_extract_index_ivf)
+    base = random_vectors(memory_index.train_size, 1)
+    memory_index.add_vectors("a", list(range(len(base))), base)
+    assert training.wait(10)
+    assert "a" in memory_index.training
+
+    extra = random_vectors(20, 2)
+    extra_ids = list(range(10000, 10000 + len(extra)))
+    # 训练期间原索引照常写入和检索
+    memory_index.add_vectors("a", extra_ids, extra)
+    assert memory_index.indexes["a"].ntotal == len(base) + len(extra)
+    resume.set()
+    deadline = time.monotonic() + 10
+    while "a" in memory_index.training and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert "a" in memory_index.quantized
+    assert "a" not in memory_index.training
+    quantized = memory_index.indexes["a"]
+    assert isinstance(faiss.downcast_index(quantized.index), faiss.IndexPreTransform)
+    assert quantized.ntotal == len(base) + len(extra)
+    ids = faiss.vector_to_array(quantized.id_map)
+    assert sorted(ids) == sorted(list(range(len(base))) + extra_ids)
+    _, found = quantized.search(extra[:5], 10)
+    assert all(extra_ids[i] in found[i] for i in range(5))
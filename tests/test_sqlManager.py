@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from memoryloom.sqlManager import AsyncSQLiteManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def count(db, table_name):
+    rows = await db.execute(f"SELECT COUNT(*) FROM {table_name}")
+    return rows[0][0]
+
+
+def test_acquire_rolls_back_on_error(tmp_path):
+    async def main():
+        async with AsyncSQLiteManager(str(tmp_path / "loom.db"), pool_size=1) as db:
+            with pytest.raises(ValueError):
+                async with db.acquire() as conn:
+                    await conn.execute("BEGIN")
+                    await conn.execute("INSERT INTO users (user_id) VALUES ('a')")
+                    raise ValueError
+            async with db.acquire() as conn:
+                assert not conn.in_transaction
+            assert await count(db, "users") == 0
+    run(main())
+
+
+def test_acquire_rolls_back_on_cancel(tmp_path):
+    async def main():
+        async with AsyncSQLiteManager(str(tmp_path / "loom.db"), pool_size=1) as db:
+            started = asyncio.Event()
+
+            async def hold():
+                async with db.acquire() as conn:
+                    await conn.execute("BEGIN")
+                    await conn.execute("INSERT INTO users (user_id) VALUES ('a')")
+                    started.set()
+                    await asyncio.Event().wait()
+
+            task = asyncio.create_task(hold())
+            await started.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # 连接已归还且事务已回滚，后续写入不会被挂起的事务卡住
+            assert await db.insert("users", {"user_id": "b"})
+            assert await db.execute("SELECT user_id FROM users") == [("b",)]
+    run(main())
+
+
+def test_insert_many_is_atomic(tmp_path):
+    async def main():
+        async with AsyncSQLiteManager(str(tmp_path / "loom.db"), pool_size=1) as db:
+            assert await db.insert_many("users", [{"user_id": "a"}, {"user_id": "b"}]) == 2
+            with pytest.raises(RuntimeError):
+                # user_id唯一，整批回滚
+                await db.insert_many("users", [{"user_id": "c"}, {"user_id": "a"}])
+            assert await count(db, "users") == 2
+            async with db.acquire() as conn:
+                assert not conn.in_transaction
+    run(main())
+
+
+def test_close_with_checked_out_connection(tmp_path):
+    async def main():
+        db = AsyncSQLiteManager(str(tmp_path / "loom.db"), pool_size=1)
+        await db.connect()
+        async with db.acquire():
+            await db.close()
+        assert db.pool.empty()
+    run(main())